@@ -0,0 +1,167 @@
+from string import ascii_lowercase
+from typing import Any, Callable
+import argparse
+import io
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import szyfry
+
+
+# 1 KB, 16 KB, 256 KB, 4 MB, 64 MB, 1 GB
+SIZES: list[int] = [1 << exponent for exponent in range(10, 31, 4)]
+KEY_A: int = 7
+KEY_B: int = 3
+
+
+def symbol_table(resolution: int = 1 << 16) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Letters with English frequencies, 2% of them uppercase, and spaces, 5% of
+    # them newlines, laid out so that a uniform index picks them with these odds
+    letters: bytes = ascii_lowercase.encode()
+    symbols: np.ndarray[Any, np.dtype[np.uint8]] = np.frombuffer(
+        letters + letters.upper() + b" \n", dtype=np.uint8)
+    frequencies: np.ndarray[Any, np.dtype[np.float64]] = np.array(
+        szyfry.LETTER_FREQUENCIES["en"])
+    weights: np.ndarray[Any, np.dtype[np.float64]] = np.concatenate(
+        (frequencies * 0.98, frequencies * 0.02, [18.0 * 0.95, 18.0 * 0.05]))
+    bounds: np.ndarray[Any, np.dtype[np.float64]] = np.cumsum(weights) / weights.sum()
+    return symbols[np.minimum(np.searchsorted(
+        bounds, (np.arange(resolution) + 0.5) / resolution), len(symbols) - 1)]
+
+
+def synthetic_text(size: int, seed: int = 0, chunk_size: int = 1 << 20) -> str:
+    # Filled chunk by chunk through uint16 indices into the symbol table, so
+    # apart from the text itself only one chunk of indices is allocated
+    rng: np.random.Generator = np.random.default_rng(seed)
+    table: np.ndarray[Any, np.dtype[np.uint8]] = symbol_table()
+    data: np.ndarray[Any, np.dtype[np.uint8]] = np.empty(size, dtype=np.uint8)
+    for start in range(0, size, chunk_size):
+        stop: int = min(start + chunk_size, size)
+        data[start:stop] = table[rng.integers(
+            0, len(table), stop - start, dtype=np.uint16)]
+    return str(data.data, "ascii")
+
+
+def check_streaming(size: int = 1 << 16) -> list[str]:
+    # The streaming path must match translating the stripped text at once,
+    # also in alphabets where whitespace is a letter
+    text: str = " \n " + synthetic_text(size) + " \n"
+    mismatches: list[str] = []
+    for name, alphabet in szyfry.ALPHABETS.items():
+        key_a: int = next(a for a in range(KEY_A, len(alphabet[0]))
+                          if math.gcd(a, len(alphabet[0])) == 1)
+        table: dict[int, int] = szyfry.affine_table(key_a, KEY_B, alphabet)
+        expected: str = text.strip().translate(table)
+        for buffer_size in (1, 7, 1000, size):
+            target: io.StringIO = io.StringIO()
+            szyfry.stream_translate(io.StringIO(text), target, table, buffer_size)
+            if target.getvalue() != expected:
+                mismatches.append(f"{name} alphabet, buffer size {buffer_size}")
+    return mismatches
+
+
+def measure(function: Callable[[], Any], repeat: int) -> tuple[float, int]:
+    # Best wall time over repeat runs, then one more run under tracemalloc
+    best: float = float("inf")
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(sizes: list[int], repeat: int = 3) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for size in sizes:
+        plaintext: str = synthetic_text(size)
+        encoded_text: str = szyfry.affine_cipher(plaintext, KEY_A, KEY_B)
+        caesar_text: str = szyfry.caesar_cipher(plaintext, KEY_B)
+        cases: dict[str, Callable[[], Any]] = {
+            "affine_cipher": lambda: szyfry.affine_cipher(plaintext, KEY_A, KEY_B),
+            "affine_decipher": lambda: szyfry.affine_decipher(encoded_text, KEY_A, KEY_B),
+            "caesar_cipher": lambda: szyfry.caesar_cipher(plaintext, KEY_B),
+            "caesar_decipher": lambda: szyfry.caesar_decipher(caesar_text, KEY_B),
+            "full_analysis_affine": lambda: szyfry.recover_affine_key(plaintext, encoded_text),
+            "full_analysis_caesar": lambda: szyfry.recover_caesar_key(plaintext, caesar_text),
+            "key_analysis_affine": lambda: szyfry.rank_keys(encoded_text, szyfry.affine_keys()),
+            "key_analysis_caesar": lambda: szyfry.rank_keys(caesar_text, [(1, b) for b in range(26)]),
+        }
+        for name, function in cases.items():
+            seconds, peak = measure(function, repeat)
+            results.append({
+                "name": name,
+                "size": size,
+                "seconds": seconds,
+                "mb_per_s": size / 1e6 / max(seconds, 1e-9),
+                "peak_bytes": peak,
+            })
+            print(f"{name:<22} {size:>11} B {seconds * 1e3:>10.3f} ms "
+                  f"{size / 1e6 / max(seconds, 1e-9):>10.1f} MB/s {peak / 1e6:>10.1f} MB peak")
+        del plaintext, encoded_text, caesar_text
+    return results
+
+
+def compare(results: list[dict[str, Any]], baseline: list[dict[str, Any]], threshold: float) -> list[str]:
+    reference: dict[tuple[str, int], float] = {
+        (entry["name"], entry["size"]): entry["seconds"] for entry in baseline}
+    regressions: list[str] = []
+    for entry in results:
+        previous: float | None = reference.get((entry["name"], entry["size"]))
+        if previous is not None and entry["seconds"] > previous * (1 + threshold):
+            regressions.append(f"{entry['name']} {entry['size']} B: "
+                               f"{previous * 1e3:.3f} ms -> {entry['seconds'] * 1e3:.3f} ms")
+    return regressions
+
+
+def cli() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the affine and Caesar ciphers and their cryptanalysis.")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="Where to write the JSON results")
+    parser.add_argument("--max-size", type=int, default=SIZES[-1],
+                        help="Largest synthetic text in bytes")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timed runs per case, the best one is kept")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown against the baseline, 0.2 = 20%%")
+
+    args = parser.parse_args()
+    mismatches: list[str] = check_streaming()
+    for mismatch in mismatches:
+        print(f"Streaming differs from the whole-file output: {mismatch}")
+    if mismatches:
+        return 1
+
+    results: list[dict[str, Any]] = run_benchmarks(
+        [size for size in SIZES if size <= args.max_size], args.repeat)
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(),
+                   "machine": platform.machine(),
+                   "results": results}, f, indent=2)
+    print(f"Created {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions: list[str] = compare(
+                results, json.load(f)["results"], args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -1,60 +1,160 @@
 # Author: Michał Pomirski
 # Date: 23.02.2024
 from string import ascii_lowercase, ascii_uppercase
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Any, ContextManager, TextIO
 import argparse
+import json
 import math
+import mmap
+import os
+import sys
+import time
+
+import numpy as np
+
+
+POLISH_LETTERS: str = "AĄBCĆDEĘFGHIJKLŁMNŃOÓPQRSŚTUVWXYZŹŻ"
+# Each string is one case of the alphabet, letters at the same index share
+# the same value x in [0, len - 1]
+ALPHABETS: dict[str, tuple[str, ...]] = {
+    "ascii": (ascii_uppercase, ascii_lowercase),
+    "pl": (POLISH_LETTERS, POLISH_LETTERS.lower()),
+    "printable": ("".join(chr(i) for i in range(32, 127)),),
+}
+ALPHABET: tuple[str, ...] = ALPHABETS["ascii"]
+DEFAULT_BUFFER_SIZE: int = 1 << 20
+
+# Relative frequencies of the letters A-Z in percent
+LETTER_FREQUENCIES: dict[str, list[float]] = {
+    "en": [8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966,
+           0.153, 0.772, 4.025, 2.406, 6.749, 7.507, 1.929, 0.095, 5.987,
+           6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074],
+    "pl": [8.91, 1.47, 3.96, 3.25, 7.66, 0.30, 1.42, 1.08, 8.21, 2.28, 3.51,
+           2.10, 2.80, 5.52, 7.75, 3.13, 0.14, 4.69, 4.32, 3.98, 2.50, 0.04,
+           4.65, 0.02, 3.76, 5.64],
+}
+
+
+@lru_cache(maxsize=16)
+def inverse_table(modulus: int) -> tuple[int, ...]:
+    # a^-1 (mod m) for every a in [0, m - 1], 0 if a has no inverse
+    return tuple(pow(a, -1, modulus) if math.gcd(a, modulus) == 1 else 0
+                 for a in range(modulus))
+
+
+@lru_cache(maxsize=64)
+def affine_table(key_a: int, key_b: int, alphabet: tuple[str, ...] = ALPHABET) -> dict[int, int]:
+    # E(a,b,x)=a·x+b (mod m), x in [0, m - 1]
+    modulus: int = len(alphabet[0])
+    return {ord(letter): ord(case[(key_a * x + key_b) % modulus])
+            for case in alphabet for x, letter in enumerate(case)}
+
 
+@lru_cache(maxsize=64)
+def affine_inverse_table(key_a: int, key_b: int, alphabet: tuple[str, ...] = ALPHABET) -> dict[int, int]:
+    # D(a,b,y)=a^-1·(y-b) (mod m), y in [0, m - 1]
+    modulus: int = len(alphabet[0])
+    inverse: int = find_inverse(key_a, modulus)
+    return {ord(letter): ord(case[(inverse * (y - key_b)) % modulus])
+            for case in alphabet for y, letter in enumerate(case)}
 
-def affine_cipher(plaintext: str, key_a: int, key_b: int) -> str:
-    # E(a,b,x)=a·x+b (mod 26), x in [0, 25]
 
-    result: str = ""
-    for letter in plaintext:
-        if letter in ascii_uppercase:
-            result += chr((key_a * (ord(letter) - ord('A')) + key_b) %
-                          26 + ord('A'))
-        elif letter in ascii_lowercase:
-            result += chr((key_a * (ord(letter) - ord('a')) + key_b) %
-                          26 + ord('a'))
-        else:
-            result += letter
+@lru_cache(maxsize=2)
+def batch_tables(decode: bool) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # One 256-byte lookup row per key, key id = (a mod 26)·26 + (b mod 26)
+    a: np.ndarray[Any, np.dtype[np.int64]] = np.repeat(np.arange(26), 26)
+    b: np.ndarray[Any, np.dtype[np.int64]] = np.tile(np.arange(26), 26)
+    x: np.ndarray[Any, np.dtype[np.int64]] = np.arange(26)
+    if decode:
+        inverse = np.array(inverse_table(26))[a]
+        letters = (inverse[:, None] * (x - b[:, None])) % 26
+    else:
+        letters = (a[:, None] * x + b[:, None]) % 26
+    tables: np.ndarray[Any, np.dtype[np.uint8]] = np.tile(
+        np.arange(256, dtype=np.uint8), (26 * 26, 1))
+    tables[:, ord('A'):ord('Z') + 1] = letters + ord('A')
+    tables[:, ord('a'):ord('z') + 1] = letters + ord('a')
+    return tables
 
-    return result
 
+def translate_batch(data: np.ndarray[Any, np.dtype[np.uint8]], offsets: np.ndarray[Any, np.dtype[np.int64]],
+                    key_a: Any, key_b: Any, decode: bool = False) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Record i is data[offsets[i]:offsets[i + 1]] and uses key (key_a[i], key_b[i])
+    offsets = np.asarray(offsets, dtype=np.int64)
+    data = np.asarray(data, dtype=np.uint8)[offsets[0]:offsets[-1]]
+    key_ids: np.ndarray[Any, np.dtype[np.int64]] = (
+        np.asarray(key_a, dtype=np.int64) % 26 * 26 + np.asarray(key_b, dtype=np.int64) % 26)
+    tables: np.ndarray[Any, np.dtype[np.uint8]] = batch_tables(decode)
+    if key_ids.size == 0:
+        return data.copy()
+    if (key_ids == key_ids[0]).all():
+        return tables[key_ids[0]][data]
+    byte_keys: np.ndarray[Any, np.dtype[np.int64]] = np.repeat(
+        key_ids, np.diff(offsets))
+    return tables.reshape(-1)[byte_keys * 256 + data]
 
-def affine_decipher(encoded_text: str, key_a: int, key_b: int) -> str:
-    result: str = ""
-    inverse = find_inverse(key_a)
 
-    for letter in encoded_text:
-        if letter in ascii_uppercase:
-            result += chr((inverse * (ord(letter) - ord('A') - key_b)) %
-                          26 + ord('A'))
-        elif letter in ascii_lowercase:
-            result += chr((inverse * (ord(letter) - ord('a') - key_b)) %
-                          26 + ord('a'))
-        else:
-            result += letter
+def affine_cipher_batch(data: np.ndarray[Any, np.dtype[np.uint8]], offsets: np.ndarray[Any, np.dtype[np.int64]],
+                        key_a: Any, key_b: Any) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    return translate_batch(data, offsets, key_a, key_b)
 
-    return result
 
+def affine_decipher_batch(data: np.ndarray[Any, np.dtype[np.uint8]], offsets: np.ndarray[Any, np.dtype[np.int64]],
+                          key_a: Any, key_b: Any) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    return translate_batch(data, offsets, key_a, key_b, decode=True)
 
-def caesar_cipher(plaintext: str, key: int) -> str:
-    return affine_cipher(plaintext, 1, key)
 
+def pack_messages(messages: list[bytes]) -> tuple[np.ndarray[Any, np.dtype[np.uint8]], np.ndarray[Any, np.dtype[np.int64]]]:
+    offsets: np.ndarray[Any, np.dtype[np.int64]] = np.zeros(
+        len(messages) + 1, dtype=np.int64)
+    np.cumsum([len(message) for message in messages], out=offsets[1:])
+    return np.frombuffer(b"".join(messages), dtype=np.uint8), offsets
 
-def caesar_decipher(encoded_text: str, key: int) -> str:
-    return affine_decipher(encoded_text, 1, key)
+
+def unpack_messages(data: np.ndarray[Any, np.dtype[np.uint8]], offsets: np.ndarray[Any, np.dtype[np.int64]]) -> list[bytes]:
+    buffer: bytes = data.tobytes()
+    base: int = int(offsets[0])
+    return [buffer[start - base:end - base] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
 
 
-def find_inverse(x: int) -> int:
-    for i in range(1, 26):
-        if (x * i) % 26 == 1:
-            return i
-    return 0
+def translate_text(text: str, key_a: int, key_b: int, decode: bool) -> str:
+    # Letters are ASCII, so every multi-byte UTF-8 sequence passes through untouched
+    data: np.ndarray[Any, np.dtype[np.uint8]] = np.frombuffer(
+        text.encode("utf-8", "surrogatepass"), dtype=np.uint8)
+    result: np.ndarray[Any, np.dtype[np.uint8]] = translate_batch(
+        data, np.array([0, data.size]), [key_a], [key_b], decode)
+    return result.tobytes().decode("utf-8", "surrogatepass")
+
+
+def affine_cipher(plaintext: str, key_a: int, key_b: int, alphabet: tuple[str, ...] = ALPHABET) -> str:
+    if alphabet == ALPHABET:
+        return translate_text(plaintext, key_a, key_b, decode=False)
+    return plaintext.translate(affine_table(key_a, key_b, alphabet))
+
+
+def affine_decipher(encoded_text: str, key_a: int, key_b: int, alphabet: tuple[str, ...] = ALPHABET) -> str:
+    if alphabet == ALPHABET:
+        return translate_text(encoded_text, key_a, key_b, decode=True)
+    return encoded_text.translate(affine_inverse_table(key_a, key_b, alphabet))
+
+
+def caesar_cipher(plaintext: str, key: int, alphabet: tuple[str, ...] = ALPHABET) -> str:
+    return affine_cipher(plaintext, 1, key, alphabet)
 
 
-def encode_files_caesar():
+def caesar_decipher(encoded_text: str, key: int, alphabet: tuple[str, ...] = ALPHABET) -> str:
+    return affine_decipher(encoded_text, 1, key, alphabet)
+
+
+def find_inverse(x: int, modulus: int = 26) -> int:
+    return inverse_table(modulus)[x % modulus]
+
+
+def encode_files_caesar(alphabet: tuple[str, ...] = ALPHABET):
     plaintext = ""
     key: list[int] = [0, 0]
     with open("plain.txt") as f:
@@ -62,26 +162,26 @@ def encode_files_caesar():
     with open("key.txt") as f:
         key = list(map(int, f.read().strip().split()))
     with open("crypto.txt", "w") as f:
-        f.write(caesar_cipher(plaintext, key[1]))
+        f.write(caesar_cipher(plaintext, key[1], alphabet))
     return 0
 
 
-def encode_files_affine():
+def encode_files_affine(alphabet: tuple[str, ...] = ALPHABET):
     plaintext = ""
     key: list[int] = [0, 0]
     with open("plain.txt") as f:
         plaintext = f.read().strip()
     with open("key.txt") as f:
         key = list(map(int, f.read().strip().split()))
-        if math.gcd(key[0], 26) != 1:
-            print("Key A must be coprime with 26")
+        if math.gcd(key[0], len(alphabet[0])) != 1:
+            print(f"Key A must be coprime with {len(alphabet[0])}")
             return 1
     with open("crypto.txt", "w") as f:
-        f.write(affine_cipher(plaintext, key[0], key[1]))
+        f.write(affine_cipher(plaintext, key[0], key[1], alphabet))
     return 0
 
 
-def decode_files_caesar():
+def decode_files_caesar(alphabet: tuple[str, ...] = ALPHABET):
     encoded_text: str = ""
     key: list[int] = [0, 0]
     with open("crypto.txt") as f:
@@ -89,22 +189,418 @@ def decode_files_caesar():
     with open("key.txt") as f:
         key = list(map(int, f.read().strip().split()))
     with open("decrypt.txt", "w") as f:
-        f.write(caesar_decipher(encoded_text, key[1]))
+        f.write(caesar_decipher(encoded_text, key[1], alphabet))
     return 0
 
 
-def decode_files_affine():
+def decode_files_affine(alphabet: tuple[str, ...] = ALPHABET):
     encoded_text: str = ""
     key: list[int] = [0, 0]
     with open("crypto.txt") as f:
         encoded_text = f.read().strip()
     with open("key.txt") as f:
         key = list(map(int, f.read().strip().split()))
-        if math.gcd(key[0], 26) != 1:
-            print("Key A must be coprime with 26")
+        if math.gcd(key[0], len(alphabet[0])) != 1:
+            print(f"Key A must be coprime with {len(alphabet[0])}")
             return 1
     with open("decrypt.txt", "w") as f:
-        f.write(affine_decipher(encoded_text, key[0], key[1]))
+        f.write(affine_decipher(encoded_text, key[0], key[1], alphabet))
+    return 0
+
+
+def open_stream(path: str, mode: str) -> ContextManager[TextIO]:
+    # "-" stands for stdin/stdout, which must not be closed afterwards
+    if path == "-":
+        return nullcontext(sys.stdin if "r" in mode else sys.stdout)
+    return open(path, mode)
+
+
+def stream_translate(source: TextIO, target: TextIO, table: dict[int, int],
+                     buffer_size: int = DEFAULT_BUFFER_SIZE) -> None:
+    # Same output as target.write(source.read().strip().translate(table)),
+    # but only one chunk plus the pending run of whitespace is kept in memory
+    started: bool = False
+    pending: str = ""
+    while chunk := source.read(buffer_size):
+        if not started:
+            chunk = chunk.lstrip()
+            started = bool(chunk)
+        body: str = chunk.rstrip()
+        if body:
+            # Whitespace inside the text is translated too, e.g. the space
+            # is a letter of the printable alphabet
+            target.write(pending.translate(table))
+            target.write(body.translate(table))
+            pending = ""
+        pending += chunk[len(body):]
+
+
+def load_key(path: str = "key.txt") -> list[int]:
+    with open(path) as f:
+        return list(map(int, f.read().strip().split()))
+
+
+def stream_files_caesar(decode: bool, input_path: str, output_path: str,
+                        buffer_size: int = DEFAULT_BUFFER_SIZE, alphabet: tuple[str, ...] = ALPHABET) -> int:
+    key: list[int] = load_key()
+    table = affine_inverse_table(1, key[1], alphabet) if decode else affine_table(
+        1, key[1], alphabet)
+    with open_stream(input_path, "r") as source, open_stream(output_path, "w") as target:
+        stream_translate(source, target, table, buffer_size)
+    return 0
+
+
+def stream_files_affine(decode: bool, input_path: str, output_path: str,
+                        buffer_size: int = DEFAULT_BUFFER_SIZE, alphabet: tuple[str, ...] = ALPHABET) -> int:
+    key: list[int] = load_key()
+    if math.gcd(key[0], len(alphabet[0])) != 1:
+        print(f"Key A must be coprime with {len(alphabet[0])}", file=sys.stderr)
+        return 1
+    table = affine_inverse_table(key[0], key[1], alphabet) if decode else affine_table(
+        key[0], key[1], alphabet)
+    with open_stream(input_path, "r") as source, open_stream(output_path, "w") as target:
+        stream_translate(source, target, table, buffer_size)
+    return 0
+
+
+def mmap_region(fileno: int, start: int, end: int, access: int) -> tuple[mmap.mmap, int]:
+    # mmap offsets must be a multiple of the allocation granularity
+    aligned: int = start - start % mmap.ALLOCATIONGRANULARITY
+    return mmap.mmap(fileno, end - aligned, access=access, offset=aligned), start - aligned
+
+
+def mmap_translate(source: mmap.mmap, target: mmap.mmap, table: bytes, start: int, end: int,
+                   slice_size: int = DEFAULT_BUFFER_SIZE) -> None:
+    for i in range(start, end, slice_size):
+        j: int = min(i + slice_size, end)
+        target[i:j] = source[i:j].translate(table)
+
+
+def mmap_files(affine: bool, decode: bool, input_path: str, output_path: str | None = None,
+               start: int = 0, end: int | None = None, slice_size: int = DEFAULT_BUFFER_SIZE) -> int:
+    # Raw ASCII bytes, nothing is stripped. Without output_path the input is
+    # changed in place. Processes working on disjoint [start, end) ranges may
+    # share the same input and output files.
+    key: list[int] = load_key()
+    key_a: int = key[0] if affine else 1
+    if math.gcd(key_a, 26) != 1:
+        print("Key A must be coprime with 26")
+        return 1
+    table: bytes = batch_tables(decode)[key_a % 26 * 26 + key[1] % 26].tobytes()
+    with open(input_path, "rb" if output_path else "r+b") as source_file:
+        size: int = os.fstat(source_file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if output_path is None:
+            if start >= end:
+                return 0
+            source, shift = mmap_region(
+                source_file.fileno(), start, end, mmap.ACCESS_WRITE)
+            with source:
+                mmap_translate(source, source, table, shift,
+                               shift + end - start, slice_size)
+                source.flush()
+            return 0
+        target_fileno: int = os.open(output_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(target_fileno).st_size != size:
+                os.ftruncate(target_fileno, size)
+            # The output is created and sized even when there is nothing to
+            # translate, e.g. for an empty input
+            if start >= end:
+                return 0
+            source, shift = mmap_region(
+                source_file.fileno(), start, end, mmap.ACCESS_READ)
+            target, _ = mmap_region(target_fileno, start, end, mmap.ACCESS_WRITE)
+            with source, target:
+                mmap_translate(source, target, table, shift,
+                               shift + end - start, slice_size)
+                target.flush()
+        finally:
+            os.close(target_fileno)
+    return 0
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def bulk_worker(task: tuple[str, str, int, int, bool, int, tuple[str, ...]]) -> tuple[str, int, float, str | None]:
+    # A file that cannot be read or decoded is reported instead of stopping
+    # the whole run, and its partial output is removed
+    input_path, output_path, key_a, key_b, decode, buffer_size, alphabet = task
+    table = affine_inverse_table(key_a, key_b, alphabet) if decode else affine_table(
+        key_a, key_b, alphabet)
+    start: float = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(input_path) as source, open(output_path, "w") as target:
+            stream_translate(source, target, table, buffer_size)
+    except (OSError, UnicodeError) as e:
+        if os.path.isfile(output_path):
+            os.remove(output_path)
+        return input_path, 0, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+    return input_path, os.path.getsize(input_path), time.perf_counter() - start, None
+
+
+# Kept in the output directory, maps each output to the parameters it was made with
+BULK_MANIFEST: str = ".szyfry-manifest.json"
+
+
+def bulk_parameters(key_a: int, key_b: int, decode: bool, affine: bool,
+                    alphabet: tuple[str, ...]) -> dict[str, Any]:
+    return {"key": [key_a, key_b], "mode": "decode" if decode else "encode",
+            "cipher": "affine" if affine else "caesar", "alphabet": list(alphabet)}
+
+
+def load_manifest(output_dir: str) -> dict[str, Any]:
+    try:
+        with open(os.path.join(output_dir, BULK_MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def bulk_tasks(input_dir: str, output_dir: str, key_a: int, key_b: int, decode: bool,
+               buffer_size: int, skip_up_to_date: bool, alphabet: tuple[str, ...] = ALPHABET,
+               affine: bool = True, key_path: str = "key.txt") -> list[tuple[str, str, int, int, bool, int, tuple[str, ...]]]:
+    # An output is up to date if it is newer than both its input and the key
+    # and was made with the same key, mode, cipher and alphabet
+    key_mtime: float = os.path.getmtime(key_path)
+    manifest: dict[str, Any] = load_manifest(output_dir)
+    parameters: dict[str, Any] = bulk_parameters(key_a, key_b, decode, affine, alphabet)
+    tasks: list[tuple[str, str, int, int, bool, int, tuple[str, ...]]] = []
+    for root, _, files in os.walk(input_dir):
+        for name in sorted(files):
+            # The manifest of an earlier bulk run is not data
+            if name == BULK_MANIFEST:
+                continue
+            input_path: str = os.path.join(root, name)
+            relative_path: str = os.path.relpath(input_path, input_dir)
+            output_path: str = os.path.join(output_dir, relative_path)
+            if skip_up_to_date and os.path.exists(output_path) and \
+                    manifest.get(relative_path) == parameters and \
+                    os.path.getmtime(output_path) >= max(os.path.getmtime(input_path), key_mtime):
+                continue
+            tasks.append((input_path, output_path, key_a,
+                         key_b, decode, buffer_size, alphabet))
+    return tasks
+
+
+def bulk_files(input_dir: str, output_dir: str, affine: bool, decode: bool, jobs: int | None = None,
+               skip_up_to_date: bool = False, buffer_size: int = DEFAULT_BUFFER_SIZE,
+               alphabet: tuple[str, ...] = ALPHABET) -> int:
+    key: list[int] = load_key()
+    key_a: int = key[0] if affine else 1
+    if math.gcd(key_a, len(alphabet[0])) != 1:
+        print(f"Key A must be coprime with {len(alphabet[0])}")
+        return 1
+    tasks: list[tuple[str, str, int, int, bool, int, tuple[str, ...]]] = bulk_tasks(
+        input_dir, output_dir, key_a, key[1], decode, buffer_size, skip_up_to_date, alphabet, affine)
+    manifest: dict[str, Any] = load_manifest(output_dir)
+    parameters: dict[str, Any] = bulk_parameters(key_a, key[1], decode, affine, alphabet)
+    total_bytes: int = 0
+    failed: int = 0
+    start: float = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=jobs or available_cores()) as executor:
+            for path, size, elapsed, error in executor.map(bulk_worker, tasks, chunksize=16):
+                if error is not None:
+                    manifest.pop(os.path.relpath(path, input_dir), None)
+                    failed += 1
+                    print(f"{path}: failed, {error}")
+                    continue
+                manifest[os.path.relpath(path, input_dir)] = parameters
+                total_bytes += size
+                print(f"{path}: {size} B in {elapsed:.3f} s "
+                      f"({size / 1e6 / max(elapsed, 1e-9):.1f} MB/s)")
+    finally:
+        # Only the outputs that were actually written are recorded
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, BULK_MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(tasks) - failed} files, {total_bytes} B in {elapsed:.3f} s "
+          f"({total_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s)")
+    if failed:
+        print(f"Failed {failed} files")
+        return 1
+    return 0
+
+
+def known_letter_pairs(plaintext: str, encoded_text: str) -> list[tuple[int, int]] | None:
+    # First occurrence of every plaintext letter and the letter it became,
+    # None if some letter was not mapped to a letter of the same case
+    pairs: list[tuple[int, int]] = []
+    for alphabet in (ascii_uppercase, ascii_lowercase):
+        for x, letter in enumerate(alphabet):
+            position: int = plaintext.find(letter)
+            if position == -1:
+                continue
+            y: int = alphabet.find(encoded_text[position])
+            if y == -1:
+                return None
+            pairs.append((x, y))
+    return pairs
+
+
+def solve_affine_key(pairs: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # y1 = a·x1+b, y2 = a·x2+b  =>  a = (y2-y1)·(x2-x1)^-1, b = y1-a·x1 (mod 26)
+    if not pairs:
+        return [(1, 0)]
+    x1, y1 = pairs[0]
+    for x2, y2 in pairs[1:]:
+        inverse: int = find_inverse((x2 - x1) % 26)
+        if inverse:
+            a: int = (y2 - y1) * inverse % 26
+            if math.gcd(a, 26) != 1:
+                return []
+            return [(a, (y1 - a * x1) % 26)]
+    # No pair with an invertible difference, every a stays possible
+    return [(a, (y1 - a * x1) % 26) for a in range(1, 26) if math.gcd(a, 26) == 1]
+
+
+def verify_affine_key(plaintext: str, encoded_text: str, key_a: int, key_b: int,
+                      chunk_size: int = DEFAULT_BUFFER_SIZE) -> bool:
+    if len(plaintext) != len(encoded_text):
+        return False
+    table: dict[int, int] = affine_table(key_a, key_b)
+    for i in range(0, len(plaintext), chunk_size):
+        if plaintext[i:i + chunk_size].translate(table) != encoded_text[i:i + chunk_size]:
+            return False
+    return True
+
+
+def recover_affine_key(plaintext: str, encoded_text: str) -> tuple[int, int] | None:
+    if len(plaintext) != len(encoded_text):
+        return None
+    pairs: list[tuple[int, int]] | None = known_letter_pairs(
+        plaintext, encoded_text)
+    if pairs is None:
+        return None
+    for a, b in solve_affine_key(pairs):
+        if verify_affine_key(plaintext, encoded_text, a, b):
+            return a, b
+    return None
+
+
+def recover_caesar_key(plaintext: str, encoded_text: str) -> int | None:
+    if len(plaintext) != len(encoded_text):
+        return None
+    pairs: list[tuple[int, int]] | None = known_letter_pairs(
+        plaintext, encoded_text)
+    if pairs is None:
+        return None
+    b: int = (pairs[0][1] - pairs[0][0]) % 26 if pairs else 0
+    if verify_affine_key(plaintext, encoded_text, 1, b):
+        return b
+    return None
+
+
+def crib_fingerprint(data: np.ndarray[Any, np.dtype[np.uint8]], affine: bool) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Non-letters stay as they are. Every letter becomes a letter of the same
+    # case encoding a key-invariant value:
+    #   Caesar  d_j = x_j - x_(j-1)              (b cancels out)
+    #   affine  d_j · d_(j-1)^-1 if d_(j-1) is a unit mod 26, otherwise the
+    #           class of d_j (0, 13, odd, even), since a is a unit it
+    #           cancels out as well
+    # The value of the first letter (and the second one for affine) depends on
+    # letters outside the window and must be ignored when matching
+    letter_values: np.ndarray[Any, np.dtype[np.int16]] = np.full(
+        256, -1, dtype=np.int16)
+    letter_values[ord('A'):ord('Z') + 1] = np.arange(26)
+    letter_values[ord('a'):ord('z') + 1] = np.arange(26)
+    values: np.ndarray[Any, np.dtype[np.int16]] = letter_values[data]
+    positions: np.ndarray[Any, np.dtype[np.int64]] = np.flatnonzero(values >= 0)
+    letters: np.ndarray[Any, np.dtype[np.uint8]] = data[positions]
+    values = values[positions]
+    diffs: np.ndarray[Any, np.dtype[np.int16]] = np.diff(values, prepend=np.int16(0)) % 26
+    tokens: np.ndarray[Any, np.dtype[np.int16]] = diffs
+    if affine:
+        digits: np.ndarray[Any, np.dtype[np.int64]] = np.arange(26)
+        inverses: np.ndarray[Any, np.dtype[np.int64]] = np.array(
+            inverse_table(26))
+        classes: np.ndarray[Any, np.dtype[np.int64]] = np.select(
+            [digits == 0, digits == 13, digits % 2 == 1], [0, 13, 1], 2)
+        # ratio_table[d_(j-1), d_j]
+        ratio_table: np.ndarray[Any, np.dtype[np.int16]] = np.where(
+            inverses[:, None] != 0, digits * inverses[:, None] % 26, classes).astype(np.int16)
+        tokens = ratio_table[np.roll(diffs, 1), diffs]
+    fingerprint: np.ndarray[Any, np.dtype[np.uint8]] = data.copy()
+    fingerprint[positions] = (letters & 0xE0) + 1 + tokens
+    return fingerprint
+
+
+def crib_keys(crib: str, window: str, affine: bool) -> list[tuple[int, int]]:
+    if len(crib) != len(window):
+        return []
+    if not affine:
+        b: int | None = recover_caesar_key(crib, window)
+        return [] if b is None else [(1, b)]
+    pairs: list[tuple[int, int]] | None = known_letter_pairs(crib, window)
+    if pairs is None:
+        return []
+    return [(a, b) for a, b in solve_affine_key(pairs)
+            if verify_affine_key(crib, window, a, b)]
+
+
+def crib_search(encoded_text: str, crib: str, affine: bool = True) -> list[tuple[int, int, int]]:
+    # Every (offset, a, b) such that crib encrypted with (a, b) appears in
+    # encoded_text at character offset
+    data: np.ndarray[Any, np.dtype[np.uint8]] = np.frombuffer(
+        encoded_text.encode("utf-8", "surrogatepass"), dtype=np.uint8)
+    crib_data: np.ndarray[Any, np.dtype[np.uint8]] = np.frombuffer(
+        crib.encode("utf-8", "surrogatepass"), dtype=np.uint8)
+    if crib_data.size == 0 or crib_data.size > data.size:
+        return []
+    haystack: bytes = crib_fingerprint(data, affine).tobytes()
+    crib_tokens: bytes = crib_fingerprint(crib_data, affine).tobytes()
+
+    # Only the part of the crib after its first one (Caesar) or two (affine)
+    # letters is fully determined, it is located with a linear-time find
+    crib_letters: np.ndarray[Any, np.dtype[np.int64]] = np.flatnonzero(
+        ((crib_data | 0x20) >= ord('a')) & ((crib_data | 0x20) <= ord('z')))
+    skipped: int = min(2 if affine else 1, crib_letters.size)
+    needle_start: int = int(crib_letters[skipped - 1]) + 1 if skipped else 0
+    needle: bytes = crib_tokens[needle_start:]
+
+    # Character offset of every byte, for texts that are not plain ASCII
+    char_starts: np.ndarray[Any, np.dtype[np.int64]] = np.flatnonzero(
+        (data & 0xC0) != 0x80)
+    results: list[tuple[int, int, int]] = []
+    position: int = haystack.find(needle, needle_start)
+    while position != -1:
+        start: int = position - needle_start
+        if start + crib_data.size > data.size:
+            break
+        try:
+            window: str = data[start:start + crib_data.size].tobytes().decode(
+                "utf-8", "surrogatepass")
+        except UnicodeDecodeError:
+            window = ""
+        offset: int = int(np.searchsorted(char_starts, start))
+        results.extend((offset, a, b)
+                       for a, b in crib_keys(crib, window, affine))
+        position = haystack.find(needle, position + 1)
+    return results
+
+
+def crib_analysis(affine: bool):
+    encoded_text = ""
+    crib = ""
+    with open("crypto.txt") as f:
+        encoded_text = f.read().strip()
+    with open("extra.txt") as f:
+        crib = f.read().strip()
+    matches: list[tuple[int, int, int]] = crib_search(
+        encoded_text, crib, affine)
+    if not matches:
+        print("Key not found")
+        return 1
+    with open("key-new.txt", "w") as f:
+        for offset, a, b in matches:
+            f.write(f"{offset} {a} {b}\n" if affine else f"{offset} {b}\n")
     return 0
 
 
@@ -115,23 +611,58 @@ def full_analysis_affine():
         encoded_text = f.read().strip()
     with open("extra.txt") as f:
         plaintext = f.read().strip()
-    for a in range(1, 26):
-        if math.gcd(a, 26) != 1:
-            continue
-        for b in range(26):
-            if affine_cipher(plaintext, a, b) == encoded_text:
-                with open("key-new.txt", "w") as f:
-                    f.write(f"{a} {b}")
-                return 0
+    key: tuple[int, int] | None = recover_affine_key(plaintext, encoded_text)
+    if key is not None:
+        with open("key-new.txt", "w") as f:
+            f.write(f"{key[0]} {key[1]}")
+        return 0
     print("Key not found")
     return 1
 
 
-def key_analysis_affine():
+def affine_keys() -> list[tuple[int, int]]:
+    return [(a, b) for a in range(1, 26) if math.gcd(a, 26) == 1
+            for b in range(26)]
+
+
+def letter_histogram(text: str) -> list[int]:
+    counts: Counter[str] = Counter(text)
+    return [counts[upper] + counts[lower]
+            for upper, lower in zip(ascii_uppercase, ascii_lowercase)]
+
+
+def chi_squared(histogram: list[int], key_a: int, key_b: int,
+                language: str = "en") -> float:
+    # Plaintext letter x was encrypted to (a·x+b) mod 26, so the observed count
+    # of x is just a permuted bin of the ciphertext histogram
+    total: int = sum(histogram)
+    if total == 0:
+        return 0.0
+    score: float = 0.0
+    for x, frequency in enumerate(LETTER_FREQUENCIES[language]):
+        expected: float = total * frequency / 100
+        observed: int = histogram[(key_a * x + key_b) % 26]
+        score += (observed - expected) ** 2 / expected
+    return score
+
+
+def rank_keys(encoded_text: str, keys: list[tuple[int, int]],
+              language: str = "en") -> list[tuple[float, int, int]]:
+    histogram: list[int] = letter_histogram(encoded_text)
+    return sorted((chi_squared(histogram, a, b, language), a, b)
+                  for a, b in keys)
+
+
+def key_analysis_affine(top: int | None = None, language: str = "en"):
     encoded_text = ""
     with open("crypto.txt") as f:
         encoded_text = f.read().strip()
     with open("key-new.txt", "w") as f:
+        if top is not None:
+            for _, a, b in rank_keys(encoded_text, affine_keys(), language)[:top]:
+                f.write(
+                    f"Key: {a} {b} : {affine_decipher(encoded_text, a, b)}\n")
+            return 1
         for a in range(1, 26):
             if math.gcd(a, 26) != 1:
                 continue
@@ -148,20 +679,25 @@ def full_analysis_caesar():
         encoded_text = f.read().strip()
     with open("extra.txt") as f:
         plaintext = f.read().strip()
-    for b in range(26):
-        if caesar_cipher(plaintext, b) == encoded_text:
-            with open("key-new.txt", "w") as f:
-                f.write(f"{b}")
-            return 0
+    key: int | None = recover_caesar_key(plaintext, encoded_text)
+    if key is not None:
+        with open("key-new.txt", "w") as f:
+            f.write(f"{key}")
+        return 0
     print("Key not found")
     return 1
 
 
-def key_analysis_caesar():
+def key_analysis_caesar(top: int | None = None, language: str = "en"):
     encoded_text = ""
     with open("crypto.txt") as f:
         encoded_text = f.read().strip()
     with open("key-new.txt", "w") as f:
+        if top is not None:
+            keys: list[tuple[int, int]] = [(1, b) for b in range(26)]
+            for _, _, b in rank_keys(encoded_text, keys, language)[:top]:
+                f.write(f"Key: {b} : {caesar_decipher(encoded_text, b)}\n")
+            return 1
         for b in range(26):
             f.write(f"Key: {b} : {caesar_decipher(encoded_text, b)}\n")
     return 1
@@ -185,43 +721,100 @@ def cli():
         "-j", "--full-analysis", action="store_true", help="Guess the key given plaintext and ciphertext")
     group_cryptoanalysis.add_argument(
         "-k", "--key-analysis", action="store_true", help="Guess the key given only ciphertext")
+    parser.add_argument(
+        "--alphabet", choices=sorted(ALPHABETS), default="ascii", help="Alphabet for encoding/decoding")
+    parser.add_argument(
+        "--crib", action="store_true", help="With -j, find extra.txt at any offset inside crypto.txt")
+    parser.add_argument(
+        "--top", type=int, help="With -k, rank keys by letter frequencies and keep only the best N")
+    parser.add_argument(
+        "--language", choices=sorted(LETTER_FREQUENCIES), default="en", help="Reference letter frequencies for --top")
+    parser.add_argument(
+        "-s", "--stream", action="store_true", help="Encode/decode chunk by chunk in constant memory")
+    parser.add_argument(
+        "-i", "--input", help="Input file for --stream (- for stdin) and --mmap")
+    parser.add_argument(
+        "-o", "--output", help="Output file for --stream (- for stdout) and --mmap")
+    parser.add_argument(
+        "-m", "--mmap", action="store_true", help="Encode/decode the raw bytes of a file through mmap, ascii alphabet only")
+    parser.add_argument(
+        "--in-place", action="store_true", help="With --mmap, overwrite the input file")
+    parser.add_argument(
+        "--range", nargs=2, type=int, metavar=("START", "END"), help="With --mmap, only process bytes [START, END)")
+    parser.add_argument(
+        "--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE, help="Chunk size for --stream, --bulk and --mmap")
+    parser.add_argument(
+        "-b", "--bulk", nargs=2, metavar=("INPUT_DIR", "OUTPUT_DIR"), help="Encode/decode every file of a directory tree")
+    parser.add_argument(
+        "--jobs", type=int, help="Worker processes for --bulk, defaults to the available cores")
+    parser.add_argument(
+        "--skip-up-to-date", action="store_true", help="With --bulk, skip outputs newer than their input and key.txt and made with the same parameters")
 
     args = parser.parse_args()
+    alphabet: tuple[str, ...] = ALPHABETS[args.alphabet]
+    if args.bulk and (args.caesar or args.affine) and (args.encode or args.decode):
+        bulk_files(args.bulk[0], args.bulk[1], args.affine, args.decode,
+                   args.jobs, args.skip_up_to_date, args.buffer_size, alphabet)
+        return
+    if args.mmap and args.alphabet != "ascii":
+        # mmap translates single bytes with the 26 letter table
+        parser.error("--mmap only supports --alphabet ascii")
+    if args.mmap and (args.caesar or args.affine) and (args.encode or args.decode):
+        source_path = args.input or (
+            "crypto.txt" if args.decode else "plain.txt")
+        target_path = None if args.in_place else args.output or (
+            "decrypt.txt" if args.decode else "crypto.txt")
+        start, end = args.range or (0, None)
+        if mmap_files(args.affine, args.decode, source_path, target_path, start, end, args.buffer_size) == 0:
+            print("Decoded" if args.decode else "Encoded")
+            print(f"Created {target_path or source_path}")
+        return
+    if args.stream and (args.caesar or args.affine) and (args.encode or args.decode):
+        input_path: str = args.input or (
+            "crypto.txt" if args.decode else "plain.txt")
+        output_path: str = args.output or (
+            "decrypt.txt" if args.decode else "crypto.txt")
+        stream_files = stream_files_caesar if args.caesar else stream_files_affine
+        if stream_files(args.decode, input_path, output_path, args.buffer_size, alphabet) == 0 and output_path != "-":
+            print("Decoded" if args.decode else "Encoded")
+            print(f"Created {output_path}")
+        return
+
     if args.caesar:
         if args.encode:
-            encode_files_caesar()
+            encode_files_caesar(alphabet)
             print("Encoded")
             print("Created crypto.txt")
         elif args.decode:
-            decode_files_caesar()
+            decode_files_caesar(alphabet)
             print("Decoded")
             print("Created decrypt.txt")
         elif args.full_analysis:
-            if full_analysis_caesar() == 0:
+            if (crib_analysis(False) if args.crib else full_analysis_caesar()) == 0:
                 print("Key found")
                 print("Created key-new.txt")
 
         elif args.key_analysis:
-            key_analysis_caesar()
+            key_analysis_caesar(args.top, args.language)
             print("Key analysis done")
             print("Created key-new.txt")
 
     elif args.affine:
         if args.encode:
-            encode_files_affine()
+            encode_files_affine(alphabet)
             print("Encoded")
             print("Created crypto.txt")
         elif args.decode:
-            decode_files_affine()
+            decode_files_affine(alphabet)
             print("Decoded")
             print("Created decrypt.txt")
         elif args.full_analysis:
-            if full_analysis_affine() == 0:
+            if (crib_analysis(True) if args.crib else full_analysis_affine()) == 0:
                 print("Key found")
                 print("Created key-new.txt")
 
         elif args.key_analysis:
-            key_analysis_affine()
+            key_analysis_affine(args.top, args.language)
             print("Key analysis done")
             print("Created key-new.txt")
 
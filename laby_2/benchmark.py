@@ -0,0 +1,134 @@
+from typing import Any, Callable, List
+import argparse
+import ast
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+import xor
+import xor_old
+
+
+# 10, 100, ..., 1 000 000 lines
+LINE_COUNTS: list[int] = [10 ** exponent for exponent in range(1, 7)]
+SYMBOLS: str = "abcdefghijklmnopqrstuvwxyz0123456789 "
+
+
+def load_poc() -> Callable[[List[str]], List[str]]:
+    # poc.py reads plain.txt and prints at import time, so only its imports
+    # and xor_decrypt are executed
+    with open("poc.py") as f:
+        tree: ast.Module = ast.parse(f.read(), "poc.py")
+    tree.body = [node for node in tree.body
+                 if isinstance(node, (ast.Import, ast.ImportFrom))
+                 or (isinstance(node, ast.FunctionDef) and node.name == "xor_decrypt")]
+    namespace: dict[str, Any] = {}
+    exec(compile(tree, "poc.py", "exec"), namespace)
+    return namespace["xor_decrypt"]
+
+
+def synthetic_corpus(lines: int, block_size: int = 64, seed: int = 0) -> tuple[List[str], List[str]]:
+    # Lines drawn from the prepare_text alphabet with English letter
+    # frequencies, encrypted with a random key of arbitrary bytes
+    rng: np.random.Generator = np.random.default_rng(seed)
+    weights: np.ndarray[Any, np.dtype[np.float64]] = np.array(
+        xor.LETTER_FREQUENCIES + [0.5] * 10 + [18.0])
+    symbols: np.ndarray[Any, np.dtype[np.uint8]] = np.frombuffer(SYMBOLS.encode(), dtype=np.uint8)
+    plain: np.ndarray[Any, np.dtype[np.uint8]] = rng.choice(
+        symbols, size=(lines, block_size), p=weights / weights.sum())
+    key: np.ndarray[Any, np.dtype[np.uint8]] = rng.integers(0, 256, block_size, dtype=np.uint8)
+    plaintext: List[str] = [line.tobytes().decode("latin-1") for line in plain]
+    crypto: List[str] = [line.tobytes().decode("latin-1") for line in plain ^ key]
+    return plaintext, crypto
+
+
+def accuracy(plaintext: List[str], decrypted: List[str]) -> tuple[float, float]:
+    # Fraction of characters recovered correctly and fraction left as _
+    total: int = sum(len(line) for line in plaintext)
+    correct: int = sum(a == b for expected, line in zip(plaintext, decrypted) for a, b in zip(expected, line))
+    unknown: int = sum(line.count("_") for line in decrypted)
+    return correct / total, unknown / total
+
+
+def measure(function: Callable[[], Any], repeat: int) -> tuple[float, int, Any]:
+    # Best wall time over repeat runs, then one more run under tracemalloc
+    best: float = float("inf")
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result: Any = function()
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def run_benchmarks(line_counts: list[int], block_size: int = 64, repeat: int = 3,
+                   legacy_max_lines: int = 100_000) -> list[dict[str, Any]]:
+    solvers: dict[str, Callable[[List[str]], List[str]]] = {
+        "xor": xor.xor_decrypt,
+        "xor_old": xor_old.xor_decrypt,
+        "poc": load_poc(),
+    }
+    results: list[dict[str, Any]] = []
+    for lines in line_counts:
+        plaintext, crypto = synthetic_corpus(lines, block_size)
+        for name, solver in solvers.items():
+            # The pure Python solvers take minutes on the largest corpora
+            if name != "xor" and lines > legacy_max_lines:
+                continue
+            entry: dict[str, Any] = {"name": name, "lines": lines, "block_size": block_size}
+            try:
+                seconds, peak, decrypted = measure(lambda: solver(crypto), repeat)
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+                print(f"{name:<8} {lines:>8} lines failed: {entry['error']}")
+                results.append(entry)
+                continue
+            correct, unknown = accuracy(plaintext, decrypted)
+            entry.update({
+                "seconds": seconds,
+                "lines_per_s": lines / max(seconds, 1e-9),
+                "peak_bytes": peak,
+                "correct": correct,
+                "unknown": unknown,
+            })
+            results.append(entry)
+            print(f"{name:<8} {lines:>8} lines {seconds * 1e3:>10.3f} ms "
+                  f"{entry['lines_per_s']:>12.0f} lines/s {peak / 1e6:>8.1f} MB peak "
+                  f"{correct:>7.2%} correct {unknown:>7.2%} _")
+        del plaintext, crypto
+    return results
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the speed and accuracy of the xor_decrypt variants.")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="Where to write the JSON results")
+    parser.add_argument("--max-lines", type=int, default=LINE_COUNTS[-1],
+                        help="Largest synthetic corpus in lines")
+    parser.add_argument("--legacy-max-lines", type=int, default=100_000,
+                        help="Largest corpus given to xor_old.py and poc.py")
+    parser.add_argument("--block-size", type=int, default=64,
+                        help="Length of the lines and the key")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timed runs per case, the best one is kept")
+
+    args = parser.parse_args()
+    results: list[dict[str, Any]] = run_benchmarks(
+        [lines for lines in LINE_COUNTS if lines <= args.max_lines],
+        args.block_size, args.repeat, args.legacy_max_lines)
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(),
+                   "machine": platform.machine(),
+                   "results": results}, f, indent=2)
+    print(f"Created {args.output}")
+
+
+if __name__ == "__main__":
+    cli()
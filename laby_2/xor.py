@@ -1,111 +1,511 @@
 import argparse
-from typing import List
+import codecs
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Iterator, List, TextIO
+
+import numpy as np
+
+
+ALLOWED_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789 "
+# Every other ASCII byte, non-ASCII characters are dropped when encoding
+DELETED_BYTES = bytes(byte for byte in range(128) if chr(byte) not in ALLOWED_CHARS)
+
+
+def normalize_stream(source: TextIO, block_length: int = 64, chunk_size: int = 1 << 20) -> Iterator[str]:
+    # Lowercased allowed characters of source cut into lines of block_length,
+    # yielded as runs of "\n"-separated lines as soon as they are complete,
+    # an incomplete last line is dropped
+    pending = b""
+    while chunk := source.read(chunk_size):
+        pending += chunk.lower().encode("ascii", "ignore").translate(None, DELETED_BYTES)
+        complete = len(pending) - len(pending) % block_length
+        if complete:
+            lines = np.full((complete // block_length, block_length + 1), ord("\n"), dtype=np.uint8)
+            lines[:, :block_length] = np.frombuffer(pending, dtype=np.uint8, count=complete).reshape(-1, block_length)
+            yield lines.tobytes()[:-1].decode("ascii")
+            pending = pending[complete:]
 
 
 def prepare_text(block_length: int = 64) -> None:
-    allowed_chars = "abcdefghijklmnopqrstuvwxyz0123456789 "
-    output = ""
-    with open("orig.txt", "r") as f:
-        output = f.read().lower()
-        output = "".join([c for c in output if c in allowed_chars])
-
-    with open("plain.txt", "w") as f:
-        for i in range(0, len(output), block_length):
-            if i + block_length < len(output):
-                f.write(output[i:i+block_length])
-            if i < len(output) - 2 * block_length:
-                f.write('\n')
+    with open("orig.txt", "r") as source, open("plain.txt", "w") as f:
+        for i, lines in enumerate(normalize_stream(source, block_length)):
+            if i:
+                f.write("\n")
+            f.write(lines)
     print(f"Prepared plain.txt with block size of {block_length}.")
 
 
-def encode_text(block_size: int = 64) -> None:
+def to_code_points(text: str) -> np.ndarray[Any, np.dtype[Any]]:
+    # One byte per character for ASCII, otherwise the UTF-32 code points
+    if text.isascii():
+        return np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+
+def from_code_points(points: np.ndarray[Any, np.dtype[Any]]) -> str:
+    if points.dtype == np.uint8:
+        return points.tobytes().decode("ascii")
+    return points.astype(np.uint32).tobytes().decode("utf-32-le", "surrogatepass")
+
+
+def split_lines(points: np.ndarray[Any, np.dtype[Any]], block_size: int) -> np.ndarray[Any, np.dtype[Any]]:
+    # (lines, block_size) matrix of the first block_size characters of every
+    # line, the same lines readlines() would return
+    newlines: np.ndarray[Any, np.dtype[np.int64]] = np.flatnonzero(
+        points == ord("\n"))
+    starts: np.ndarray[Any, np.dtype[np.int64]] = np.concatenate(([0], newlines + 1))
+    ends: np.ndarray[Any, np.dtype[np.int64]] = np.append(newlines, points.size)
+    if starts[-1] == points.size:
+        starts, ends = starts[:-1], ends[:-1]
+    if np.any(ends - starts < block_size):
+        raise IndexError("every line must be at least block_size characters long")
+    if np.all(ends - starts == block_size):
+        if points.size % (block_size + 1):
+            points = np.append(points, np.array(ord("\n"), dtype=points.dtype))
+        return points.reshape(-1, block_size + 1)[:, :block_size]
+    return points[starts[:, None] + np.arange(block_size)]
+
+
+# crypto.bin: magic, version, bytes per character, block size, line count,
+# padded to CONTAINER_HEADER_SIZE, then line count records of block size
+# characters each
+CONTAINER_MAGIC = b"XORC"
+CONTAINER_VERSION = 1
+CONTAINER_HEADER = struct.Struct("<4sHHIQ")
+CONTAINER_HEADER_SIZE = 32
+CONTAINER_DTYPES = {1: np.dtype(np.uint8), 4: np.dtype("<u4")}
+
+
+def write_container(path: str, matrix: np.ndarray[Any, np.dtype[Any]]) -> None:
+    header = CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, matrix.dtype.itemsize,
+                                   matrix.shape[1], matrix.shape[0])
+    with open(path, "wb") as f:
+        f.write(header.ljust(CONTAINER_HEADER_SIZE, b"\0"))
+        np.ascontiguousarray(matrix, dtype=CONTAINER_DTYPES[matrix.dtype.itemsize]).tofile(f)
+
+
+def is_container(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+
+
+def crypto_source(binary: bool = False) -> tuple[str, bool]:
+    # The ciphertext file and whether it is a container. Without binary the
+    # more recently written of crypto.txt and crypto.bin is used, so the
+    # output of the last -e is read whether or not it used -b, and a
+    # container is recognised by its header
+    if binary:
+        return "crypto.bin", True
+    existing = [path for path in ("crypto.txt", "crypto.bin") if os.path.exists(path)]
+    if not existing:
+        return "crypto.txt", False
+    path = max(existing, key=os.path.getmtime)
+    return path, is_container(path)
+
+
+def open_container(path: str) -> np.ndarray[Any, np.dtype[Any]]:
+    # (lines, block size) matrix mapped straight from the file, reaching any
+    # line or range of lines reads only those records
+    with open(path, "rb") as f:
+        magic, version, itemsize, block_size, line_count = CONTAINER_HEADER.unpack(
+            f.read(CONTAINER_HEADER.size))
+    if magic != CONTAINER_MAGIC or version != CONTAINER_VERSION or itemsize not in CONTAINER_DTYPES:
+        raise ValueError(f"{path} is not a version {CONTAINER_VERSION} ciphertext container")
+    if line_count == 0:
+        return np.zeros((0, block_size), dtype=CONTAINER_DTYPES[itemsize])
+    return np.memmap(path, dtype=CONTAINER_DTYPES[itemsize], mode="r",
+                     offset=CONTAINER_HEADER_SIZE, shape=(line_count, block_size))
+
+
+def encode_text(block_size: int = 64, binary: bool = False) -> None:
     with open("plain.txt", "r") as f:
-        plaintext = [line.rstrip("\n") for line in f.readlines()]
+        plaintext = f.read()
 
     with open("key.txt", "r") as f:
         key = f.read()
 
+    lines = split_lines(to_code_points(plaintext), block_size)
+    key_points = to_code_points(key)[:block_size]
+    if key_points.size < block_size:
+        raise IndexError("key must be at least block_size characters long")
+
+    if binary:
+        write_container("crypto.bin", lines ^ key_points)
+        print("Encoded plain.txt with key.txt and saved to crypto.bin.")
+        return
     with open("crypto.txt", "w") as f:
-        for line in plaintext:
-            for i in range(block_size):
-                f.write(chr(ord(line[i]) ^ ord(key[i])))
+        f.write(from_code_points((lines ^ key_points).ravel()))
     print("Encoded plain.txt with key.txt and saved to crypto.txt.")
 
 
-def decode_text(block_size: int = 64) -> None:
-    with open("crypto.txt", "r") as crypto:
-        file = crypto.read()
+def decode_text(block_size: int = 64, binary: bool = False, line_range: tuple[int, int] | None = None) -> None:
+    # A container's header overrides block_size
+    source, binary = crypto_source(binary)
+    if binary:
+        crypto = open_container(source)
+        block_size = crypto.shape[1]
+    else:
+        with open(source, "r") as crypto_file:
+            points = to_code_points(crypto_file.read())
+        if points.size % block_size:
+            raise IndexError(f"{source} must consist of whole blocks of block_size characters")
+        crypto = points.reshape(-1, block_size)
     with open("key.txt", "r") as key_file:
         key = key_file.read()
 
+    key_points = to_code_points(key)[:block_size]
+    if key_points.size < block_size:
+        raise IndexError("key must be at least block_size characters long")
+    if line_range is not None:
+        crypto = crypto[line_range[0]:line_range[1]]
+
+    lines = crypto ^ key_points
+    lines[lines == ord("'")] = ord(" ")
+    output = np.full((lines.shape[0], block_size + 1), ord("\n"), dtype=lines.dtype)
+    output[:, :block_size] = lines
     with open("decoded.txt", "w") as f:
-        for i in range(0, len(file), block_size):
-            for j in range(block_size):
-                if chr(ord(file[i+j]) ^ ord(key[j])) == '\'':
-                    f.write(" ")
-                else:
-                    f.write(chr(ord(file[i+j]) ^ ord(key[j])))
-            f.write("\n") if i < len(file) - block_size else None
+        f.write(from_code_points(output.ravel()[:-1]))
+
+    print(f"Decoded {source} with key.txt and saved to decoded.txt.")
+
+
+LETTER_FREQUENCIES = [8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966,
+                      0.153, 0.772, 4.025, 2.406, 6.749, 7.507, 1.929, 0.095, 5.987,
+                      6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074]
+
+
+def char_log_probabilities() -> np.ndarray[Any, np.dtype[np.float64]]:
+    # Model of the prepared plaintext: lowercase letters with English
+    # frequencies, spaces, rare digits, very rare other printable characters
+    probabilities = np.full(256, 1e-9)
+    probabilities[32:127] = 1e-4
+    probabilities[ord("A"):ord("Z") + 1] = 1e-3
+    probabilities[ord("0"):ord("9") + 1] = 1e-3
+    probabilities[ord("a"):ord("z") + 1] = np.array(LETTER_FREQUENCIES) / 100 * 0.8
+    probabilities[ord(" ")] = 0.18
+    return np.log(probabilities / probabilities.sum())
+
+
+# SCORES[c, k]: log-probability of the plaintext byte c ^ k
+SCORES = char_log_probabilities()[np.arange(256)[:, None] ^ np.arange(256)]
+
+
+# Pads short lines in to_matrix, above any code point so it cannot be text
+PADDING = 0xFFFFFFFF
+
+
+def to_matrix(lines: List[str]) -> np.ndarray[Any, np.dtype[Any]]:
+    # (rows, width) matrix of code points, shorter lines padded with PADDING
+    lengths = np.array([len(line) for line in lines])
+    points = to_code_points("".join(lines))
+    if np.all(lengths == lengths[0]):
+        return points.reshape(len(lines), lengths[0])
+    matrix = np.full((len(lines), lengths.max()), PADDING, dtype=np.uint32)
+    matrix[np.arange(lengths.max()) < lengths[:, None]] = points
+    return matrix
+
+
+def column_counts(matrix: np.ndarray[Any, np.dtype[Any]]) -> np.ndarray[Any, np.dtype[np.int64]]:
+    # counts[i, c]: how many times low byte c appears in column i. With ASCII
+    # plaintext the higher bits of a code point all come from the key, so
+    # only the low byte of a non-ASCII key character is left to guess
+    width = matrix.shape[1]
+    columns = np.broadcast_to(np.arange(width), matrix.shape)
+    known = matrix != PADDING
+    return np.bincount((columns[known] * 256 + (matrix[known] & 0xFF)).astype(np.int64),
+                       minlength=width * 256).reshape(width, 256)
+
 
-    print("Decoded crypto.txt with key.txt and saved to decoded.txt.")
+def guess_key(counts: np.ndarray[Any, np.dtype[np.int64]]) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Score of key k for a column is sum over rows of log P(c ^ k), grouping
+    # equal ciphertext bytes turns it into counts @ SCORES
+    return np.argmax(counts @ SCORES, axis=1).astype(np.uint8)
+
+
+def decrypt_matrix(matrix: np.ndarray[Any, np.dtype[Any]], key: np.ndarray[Any, np.dtype[np.uint8]]) -> List[str]:
+    width = matrix.shape[1]
+    plain = (matrix & 0xFF) ^ key[:width]
+    plain[(plain < 32) | (plain > 126)] = ord("_")
+    text = plain.astype(np.uint8).tobytes().decode("ascii")
+    lengths = (matrix != PADDING).sum(axis=1).tolist()
+    return [text[i * width:i * width + length] for i, length in enumerate(lengths)]
+
+
+def solve_matrix(matrix: np.ndarray[Any, np.dtype[Any]], jobs: int = 1) -> List[str]:
+    if matrix.shape[0] == 0:
+        return []
+    key = parallel_guess_key(matrix, jobs) if jobs > 1 else guess_key(column_counts(matrix))
+    return decrypt_matrix(matrix, key)
 
 
 def xor_decrypt(lines: List[str]) -> List[str]:
-    cols = [[line[i] for line in lines] for i in range(len(lines[0]))]
-    decrypted_cols = []
+    if not lines:
+        return []
+    return solve_matrix(to_matrix(lines))
 
-    for col in cols:
-        line = ["" for _ in range(len(col))]
-        diffs = [ord(col[i]) ^ ord(col[i+1]) for i in range(len(col)-1)]
 
-        i = 0
-        while i <= len(diffs):
-            try:
-                if diffs[i] >> 5 == 0 and diffs[i+1] >> 5 == 2 and diffs[i+2] >> 5 == 2:
-                    line[i] = chr(diffs[i] ^ diffs[i+1] ^ 0b00100000)
-                    line[i+1] = chr(0b00100000 ^ diffs[i+1])
-                    line[i+2] = chr(0b00100000 ^ diffs[i+2])
-                    i += 3
-                elif diffs[i] >> 5 == 2 and diffs[i+1] >> 5 == 2 and diffs[i+2] >> 5 == 0 and i < len(line) - 2:
-                    line[i] = chr(0b00100000 ^ diffs[i])
-                    line[i+1] = chr(0b00100000)
-                    line[i+2] = chr(0b00100000 ^ diffs[i+1])
-                    i += 3
-                elif diffs[i] == diffs[i+2] and diffs[i] >> 5 == 0 and diffs[i+1] >> 5 == 2:
-                    line[i] = chr(0b00100000)
-                    line[i+1] = chr(diffs[i+1] ^ 0b00100000)
-                    line[i+2] = chr(0b00100000)
-                    i += 3
-                elif diffs[i] >> 5 == 0 and diffs[i+1] >> 5 == 2 and diffs[i+2] >> 5 == 0:
-                    line[i] = chr(diffs[i] ^ diffs[i+1] ^ 0b00100000)
-                    line[i+1] = chr(0b00100000 ^ diffs[i+1])
-                    line[i+2] = chr(0b00100000)
-                    i += 3
-                elif diffs[i] >> 5 == 2 and diffs[i+1] >> 5 == 0 and diffs[i+2] >> 5 == 0:
-                    line[i] = chr(0b00100000)
-                    line[i+1] = chr(diffs[i] ^ 0b00100000)
-                    line[i+2] = chr(diffs[i+1] ^ diffs[i] ^ 0b00100000)
-                    i += 1
-                else:
-                    line[i] = "_"
-                    i += 1
-            except IndexError:
-                line[i] = "_"
-                i += 1
-
-        decrypted_cols.append("".join(line))
-
-    decrypted_lines = ["".join([col[i] for col in decrypted_cols]) for i in range(len(decrypted_cols[0]))]
-    return decrypted_lines
-
-
-def cryptoanalysis(block_size: int = 64) -> None:
+def guess_key_columns(task: tuple[str, tuple[int, ...], str, int, int]) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Worker: key bytes for columns [start, end) of the matrix in shared memory
+    name, shape, dtype, start, end = task
+    shared = shared_memory.SharedMemory(name=name)
+    try:
+        matrix = np.ndarray(shape, dtype=dtype, buffer=shared.buf)
+        key = guess_key(column_counts(matrix[:, start:end]))
+        del matrix
+    finally:
+        shared.close()
+    return key
+
+
+def parallel_guess_key(matrix: np.ndarray[Any, np.dtype[Any]], jobs: int) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Same result as guess_key(column_counts(matrix)), columns are split into
+    # contiguous ranges and solved by a process pool reading the ciphertext
+    # from shared memory
+    width = matrix.shape[1]
+    shared = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+    try:
+        shared_matrix = np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=shared.buf)
+        shared_matrix[:] = matrix
+        del shared_matrix
+        bounds = np.linspace(0, width, min(jobs, width) + 1).astype(int).tolist()
+        tasks = [(shared.name, matrix.shape, matrix.dtype.str, start, end)
+                 for start, end in zip(bounds[:-1], bounds[1:])]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            key = np.concatenate(list(executor.map(guess_key_columns, tasks)))
+    finally:
+        shared.close()
+        shared.unlink()
+    return key
+
+
+def parallel_xor_decrypt(lines: List[str], jobs: int) -> List[str]:
+    if not lines:
+        return []
+    return solve_matrix(to_matrix(lines), jobs)
+
+
+# PRINTABLE_UNDER_KEY[c, k]: whether c ^ k is a printable ASCII character
+PRINTABLE_UNDER_KEY = ((np.arange(256)[:, None] ^ np.arange(256)) >= 32) & \
+    ((np.arange(256)[:, None] ^ np.arange(256)) <= 126)
+
+
+class CribDragger:
+    # Guessing that line i holds crib at offset o fixes the key bytes
+    # k = c_i[o:o+m] ^ crib, and every other line j then reads c_j ^ k there.
+    # Instead of caching all pairwise XORs c_i ^ c_j, the number of lines of
+    # each column that are printable under each key byte is counted once,
+    # which answers the same question for all lines in a single lookup.
+    def __init__(self, lines: List[str], key_path: str = "partial-key.txt") -> None:
+        self.matrix = to_matrix(lines)
+        counts = column_counts(self.matrix)
+        self.printable = counts @ PRINTABLE_UNDER_KEY
+        self.known = counts.sum(axis=1)
+        # cells[i, j] indexes the (column j, low byte) entry of a flat
+        # width x 256 table, padding points past its end at an entry that is
+        # always False
+        width = self.matrix.shape[1]
+        self.cells = np.arange(width, dtype=np.int32) * 256 + (self.matrix & 0xFF).astype(np.int32)
+        self.cells[self.matrix == PADDING] = width * 256
+        self.key_path = key_path
+        self.key = np.full(self.matrix.shape[1], -1, dtype=np.int16)
+        try:
+            with open(key_path, "r") as f:
+                saved = [-1 if byte == "__" else int(byte, 16) for byte in f.read().split()]
+            self.key[:len(saved)] = saved[:len(self.key)]
+        except FileNotFoundError:
+            pass
+
+    def search(self, crib: str, min_fraction: float = 1.0) -> List[tuple[int, int]]:
+        # Every (line, offset) where the crib leaves at least min_fraction of
+        # the lines printable in all of its columns
+        crib_points = to_code_points(crib)
+        width = self.matrix.shape[1]
+        if crib_points.size == 0 or crib_points.size > width or crib_points.max() > 255:
+            return []
+        good = self.printable >= min_fraction * self.known[:, None]
+        # tables[p][cells[i, j]]: is column j good under the key byte that
+        # turns line i into p there, one lookup per cell and crib character
+        tables = {point: np.append(good[:, np.arange(256) ^ point].ravel(), False)
+                  for point in set(crib_points.tolist())}
+        # The first character is checked at every (line, offset), the rest
+        # only where all previous characters matched
+        lines, offsets = np.nonzero(
+            tables[int(crib_points[0])][self.cells[:, :width - crib_points.size + 1]])
+        for i, point in enumerate(crib_points[1:].tolist(), 1):
+            keep = tables[point][self.cells[lines, offsets + i]]
+            lines, offsets = lines[keep], offsets[keep]
+        return list(zip(lines.tolist(), offsets.tolist()))
+
+    def preview(self, line: int, offset: int, crib: str) -> List[str]:
+        crib_points = to_code_points(crib)
+        window = self.matrix[:, offset:offset + crib_points.size]
+        plain = (window & 0xFF) ^ (window[line] & 0xFF) ^ crib_points
+        plain[window == PADDING] = ord("_")
+        plain[(plain < 32) | (plain > 126)] = ord("_")
+        return [row.astype(np.uint8).tobytes().decode("ascii") for row in plain]
+
+    def confirm(self, line: int, offset: int, crib: str) -> None:
+        crib_points = to_code_points(crib)
+        height, width = self.matrix.shape
+        if not 0 <= line < height:
+            raise ValueError(f"line must be between 0 and {height - 1}")
+        if crib_points.size == 0 or offset < 0 or offset + crib_points.size > width:
+            raise ValueError(f"the crib must fit between offsets 0 and {width}")
+        if crib_points.max() > 255:
+            raise ValueError("the crib must consist of single-byte characters")
+        if (self.matrix[line, offset:offset + crib_points.size] == PADDING).any():
+            raise ValueError("the crib must not run past the end of the line")
+        self.key[offset:offset + crib_points.size] = \
+            (self.matrix[line, offset:offset + crib_points.size] & 0xFF) ^ crib_points
+        with open(self.key_path, "w") as f:
+            f.write(" ".join("__" if byte < 0 else f"{byte:02x}" for byte in self.key.tolist()))
+
+    def decrypt(self) -> List[str]:
+        plain = (self.matrix & 0xFF) ^ self.key.astype(np.uint32)
+        plain[(plain < 32) | (plain > 126) | (self.key < 0)] = ord("_")
+        width = self.matrix.shape[1]
+        text = plain.astype(np.uint8).tobytes().decode("ascii")
+        lengths = (self.matrix != PADDING).sum(axis=1).tolist()
+        return [text[i * width:i * width + length] for i, length in enumerate(lengths)]
+
+
+def crib_drag(block_size: int = 64) -> None:
     with open("crypto.txt", "r") as f:
         crypto_text = f.read()
     blocks = [crypto_text[i:i+block_size] for i in range(0, len(crypto_text), block_size)]
+    dragger = CribDragger(blocks)
+    print("Type a crib to drag it over crypto.txt, !LINE OFFSET CRIB to confirm it,")
+    print("? to show the partial decryption, an empty line to quit.")
+    while True:
+        try:
+            command = input("crib> ")
+        except EOFError:
+            break
+        if not command:
+            break
+        if command == "?":
+            print("\n".join(dragger.decrypt()))
+        elif command.startswith("!"):
+            try:
+                line, offset, crib = command[1:].split(" ", 2)
+                dragger.confirm(int(line), int(offset), crib)
+            except ValueError as e:
+                print(f"Usage: !LINE OFFSET CRIB ({e})")
+                continue
+            print(f"Key updated and saved to {dragger.key_path}.")
+        else:
+            hits = dragger.search(command)
+            for line, offset in hits[:20]:
+                print(f"line {line} offset {offset}: {'|'.join(dragger.preview(line, offset, command)[:8])}")
+            print(f"{len(hits)} matches.")
+
+
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def rank_periods(points: np.ndarray[Any, np.dtype[Any]], max_period: int = 4096,
+                 sample_size: int = 1 << 16) -> List[tuple[int, float, float]]:
+    # (period, coincidence rate, normalized Hamming distance) for every
+    # candidate period, best first. Shifting the ciphertext by the key length
+    # cancels the key: c_i ^ c_(i+p) = m_i ^ m_(i+p), so equal characters
+    # coincide far more often and the XOR has fewer set bits than for a
+    # wrong period.
+    results = []
+    for period in range(1, min(max_period, points.size // 2) + 1):
+        size = min(points.size - period, sample_size)
+        first, second = points[:size], points[period:period + size]
+        coincidence = float(np.count_nonzero(first == second)) / size
+        hamming = float(POPCOUNT[(first ^ second) & 0xFF].mean()) / 8
+        results.append((period, coincidence, hamming))
+    return sorted(results, key=lambda result: (-result[1], result[2], result[0]))
+
+
+def detect_block_size(points: np.ndarray[Any, np.dtype[Any]], max_period: int = 4096) -> int:
+    # Multiples of the key length score as well as the key length itself,
+    # so take the shortest period close to the best score
+    ranking = rank_periods(points, max_period)
+    if not ranking:
+        return 1
+    best = ranking[0][1]
+    return min(period for period, coincidence, _ in ranking if coincidence >= 0.9 * best)
+
+
+def cryptoanalysis(block_size: int | None = 64, jobs: int = 1, binary: bool = False) -> None:
+    # block_size=None detects the key length first, a container's header
+    # already holds the block size
+    source, binary = crypto_source(binary)
+    if binary:
+        with open("decrypt.txt", "w") as f:
+            f.write("\n".join(solve_matrix(open_container(source), jobs)))
+        print(f"Performed cryptoanalysis on {source} and saved to decrypt.txt.")
+        return
+    with open(source, "r") as f:
+        crypto_text = f.read()
+    if block_size is None:
+        points = to_code_points(crypto_text)
+        for period, coincidence, hamming in rank_periods(points)[:5]:
+            print(f"Period {period}: coincidence {coincidence:.4f}, Hamming distance {hamming:.4f}")
+        block_size = detect_block_size(points)
+        print(f"Detected block size of {block_size}.")
+    blocks = [crypto_text[i:i+block_size] for i in range(0, len(crypto_text), block_size)]
+    decrypted = parallel_xor_decrypt(blocks, jobs) if jobs > 1 else xor_decrypt(blocks)
     with open("decrypt.txt", "w") as f:
-        f.write("\n".join(xor_decrypt(blocks)))
-    print("Performed cryptoanalysis on crypto.txt and saved to decrypt.txt.")
+        f.write("\n".join(decrypted))
+    print(f"Performed cryptoanalysis on {source} and saved to decrypt.txt.")
+
+
+def online_cryptoanalysis(block_size: int = 64, binary: bool = False, state_path: str = "online-state.npz") -> None:
+    # Folds only the lines appended to the ciphertext since the last call into
+    # the per-column byte counts kept in state_path. The counts are sufficient
+    # statistics for guess_key, so each update costs O(new lines).
+    # key-online.txt always holds the estimate from all lines so far, while
+    # decrypt-online.txt is replaced by the new lines decrypted with it
+    source, binary = crypto_source(binary)
+    if binary:
+        # A container's header holds the block size
+        container = open_container(source)
+        block_size = container.shape[1]
+    try:
+        with np.load(state_path) as state:
+            counts, position = state["counts"], int(state["position"])
+            if str(state["source"]) != source:
+                raise ValueError(f"{state_path} was built from {state['source']}, not {source}")
+            # Older state files only have the block size as the width of counts
+            state_block_size = int(state["block_size"]) if "block_size" in state.files else counts.shape[0]
+            if state_block_size != block_size:
+                raise ValueError(f"{state_path} was built with block size {state_block_size}, not {block_size}")
+    except FileNotFoundError:
+        counts, position = None, 0
+
+    if binary:
+        matrix = np.asarray(container[position:])
+        position += matrix.shape[0]
+    else:
+        with open(source, "rb") as f:
+            f.seek(position)
+            # Only whole characters and whole lines are consumed, the rest is
+            # picked up by the next update
+            text = codecs.getincrementaldecoder("utf-8")().decode(f.read())
+        text = text[:len(text) - len(text) % block_size]
+        position += len(text.encode("utf-8"))
+        matrix = to_code_points(text).reshape(-1, block_size)
+
+    if counts is None:
+        counts = np.zeros((block_size, 256), dtype=np.int64)
+    counts += column_counts(matrix)
+    key = guess_key(counts)
+    np.savez(state_path, counts=counts, position=position, source=source, block_size=block_size)
+
+    with open("key-online.txt", "w") as f:
+        f.write(" ".join(f"{byte:02x}" for byte in key.tolist()))
+    with open("decrypt-online.txt", "w") as f:
+        for line in decrypt_matrix(matrix, key):
+            f.write(line + "\n")
+    print(f"Added {matrix.shape[0]} lines of {source} ({int(counts[0].sum())} in total), "
+          f"saved the key estimate to key-online.txt and the new lines to decrypt-online.txt.")
 
 
 def cli():
@@ -115,16 +515,32 @@ def cli():
     actions.add_argument("-e", "--encode", action="store_true", help="Encode text")
     actions.add_argument("-d", "--decode", action="store_true", help="Decode text")
     actions.add_argument("-k", "--cryptoanalysis", action="store_true", help="Perform cryptoanalysis")
+    actions.add_argument("-o", "--online", action="store_true", help="Update the key estimate with newly appended ciphertext")
+    actions.add_argument("-c", "--crib-drag", action="store_true", help="Drag guessed words over the ciphertext")
+
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes for cryptoanalysis")
+    parser.add_argument("--block-size", default="64", help="Block size for cryptoanalysis, auto to detect it")
+    parser.add_argument("-b", "--binary", action="store_true", help="Write or prefer the crypto.bin container over crypto.txt")
+    lines = parser.add_mutually_exclusive_group()
+    lines.add_argument("--line", type=int, help="Decode only line LINE")
+    lines.add_argument("--lines", type=int, nargs=2, metavar=("START", "END"), help="Decode only lines [START, END)")
 
     args = parser.parse_args()
     if args.prepare:
         prepare_text()
     elif args.encode:
-        encode_text()
+        encode_text(binary=args.binary)
     elif args.cryptoanalysis:
-        cryptoanalysis()
+        cryptoanalysis(None if args.block_size == "auto" else int(args.block_size), args.jobs, args.binary)
     elif args.decode:
-        decode_text()
+        line_range = (args.line, args.line + 1) if args.line is not None else args.lines
+        decode_text(binary=args.binary, line_range=line_range)
+    elif args.online:
+        if args.block_size == "auto":
+            parser.error("--online needs a fixed --block-size, auto is only supported with -k")
+        online_cryptoanalysis(int(args.block_size), args.binary)
+    elif args.crib_drag:
+        crib_drag()
 
 
 if __name__ == "__main__":
@@ -1,72 +1,254 @@
+import argparse
 import hmac
-from PIL import Image
 import numpy as np
-import matplotlib.pyplot as plt
 import hashlib
-from typing import Any
+import struct
+import time
+from typing import Any, Callable
 
 
-def load_image(path: str) -> np.ndarray[Any, np.dtype[np.uint8]]:
-    img: Image.Image = Image.open(path).convert("L")
+def load_image(path: str, colour: bool = False) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Pillow is only imported when an image is actually decoded
+    from PIL import Image
+    img: Image.Image = Image.open(path).convert("RGB" if colour else "L")
     return np.array(img)
 
 
 def split_into_blocks(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # H x W x C images give one block per channel, the channels of a block
+    # position follow each other, so all of them are encoded in one batch
     height: int
     width: int
-    height, width = image.shape
-    return image.reshape(height // block_size, block_size, width // block_size, block_size).swapaxes(1, 2).reshape(-1, block_size, block_size)
+    height, width = image.shape[:2]
+    channels: int = image.shape[2] if image.ndim == 3 else 1
+    return image.reshape(height // block_size, block_size, width // block_size, block_size, channels).transpose(0, 2, 4, 1, 3).reshape(-1, block_size, block_size)
 
 
 def join_blocks(blocks: np.ndarray[Any, np.dtype[np.uint8]], image_shape: tuple[int, ...]) -> np.ndarray[Any, np.dtype[np.uint8]]:
     height: int
     width: int
-    height, width = image_shape
+    height, width = image_shape[:2]
+    channels: int = image_shape[2] if len(image_shape) == 3 else 1
     block_size: int = blocks.shape[1]
-    return blocks.reshape(height // block_size, width // block_size, block_size, block_size).swapaxes(1, 2).reshape(height, width)
+    return blocks.reshape(height // block_size, width // block_size, channels, block_size, block_size).transpose(0, 3, 1, 4, 2).reshape(image_shape)
 
 
-def encode_single_block(block: np.ndarray[Any, np.dtype[np.uint8]], key: str = "") -> np.ndarray[Any, np.dtype[np.uint8]]:
-    block_shape: tuple[int, ...] = block.shape
-    byte_string: str = hmac.new(
-        key.encode(), block.tobytes(), hashlib.md5).hexdigest()
-    decoded_array = np.frombuffer(bytes.fromhex(
-        byte_string), dtype=np.uint8)
+def blake2_key(key: bytes, limit: int) -> bytes:
+    # Keys longer than BLAKE2 accepts are hashed first, like HMAC does
+    return key if len(key) <= limit else hashlib.blake2b(key, digest_size=limit).digest()
 
-    # padding with zeros if needed
-    if len(decoded_array) < block.size:
-        decoded_array = np.pad(
-            decoded_array, (0, block.size - len(decoded_array)))
-    decoded_array = decoded_array.reshape(block_shape)
-    return decoded_array
 
+def shake_key(key: bytes) -> Any:
+    # The length prefix keeps the key and the block apart
+    return hashlib.shake_128(len(key).to_bytes(8, "little") + key)
 
-def encode_blocks_ECB(blocks: np.ndarray[Any, np.dtype[np.uint8]], key: str = "") -> np.ndarray[Any, np.dtype[np.uint8]]:
+
+# Keyed PRFs taking the key and the block size in bytes. BLAKE2 digests are
+# sized to the block, as far as the algorithm allows, and SHAKE produces any
+# length, so only the HMACs need zero padding
+PRF_BACKENDS: dict[str, Callable[[bytes, int], Any]] = {
+    "hmac-md5": lambda key, size: hmac.new(key, digestmod=hashlib.md5),
+    "hmac-sha256": lambda key, size: hmac.new(key, digestmod=hashlib.sha256),
+    "blake2b": lambda key, size: hashlib.blake2b(key=blake2_key(key, 64), digest_size=min(size, 64)),
+    "blake2s": lambda key, size: hashlib.blake2s(key=blake2_key(key, 32), digest_size=min(size, 32)),
+    "shake128": lambda key, size: shake_key(key),
+}
+
+
+def keyed_mac(key: str = "", backend: str = "hmac-md5", block_bytes: int = 16) -> Any:
+    # The key is processed once here, every block works on a copy
+    return PRF_BACKENDS[backend](key.encode(), block_bytes)
+
+
+def encode_into(mac: Any, block: np.ndarray[Any, np.dtype[np.uint8]], out: np.ndarray[Any, np.dtype[np.uint8]]) -> None:
+    # Writes the raw digest into the flat, zero filled out, so blocks larger
+    # than the digest keep the zero padding
+    block_mac: Any = mac.copy()
+    block_mac.update(block.tobytes())
+    digest: bytes = block_mac.digest(out.size) if block_mac.name.startswith(
+        "shake") else block_mac.digest()[:out.size]
+    out[:len(digest)] = np.frombuffer(digest, dtype=np.uint8)
+
+
+def encode_single_block(block: np.ndarray[Any, np.dtype[np.uint8]], key: str = "", backend: str = "hmac-md5") -> np.ndarray[Any, np.dtype[np.uint8]]:
     result: np.ndarray[Any, np.dtype[np.uint8]] = np.zeros(
-        blocks.shape, dtype=np.uint8)
-    for i, block in enumerate(blocks):
-        result[i] = encode_single_block(block, key)
+        block.size, dtype=np.uint8)
+    encode_into(keyed_mac(key, backend, block.size), block, result)
+    return result.reshape(block.shape)
 
-    return result
 
+def encode_blocks_ECB(blocks: np.ndarray[Any, np.dtype[np.uint8]], key: str = "", backend: str = "hmac-md5") -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Equal blocks encode to equal blocks, so every distinct block is encoded
+    # once and the results are scattered back with the inverse index
+    unique_blocks: np.ndarray[Any, np.dtype[np.uint8]]
+    inverse: np.ndarray[Any, np.dtype[np.intp]]
+    unique_blocks, inverse = np.unique(
+        blocks.reshape(len(blocks), -1), axis=0, return_inverse=True)
+    unique_blocks = unique_blocks.reshape(-1, *blocks.shape[1:])
 
-def encode_blocks_CBC(blocks: np.ndarray[Any, np.dtype[np.uint8]], key: str = "") -> np.ndarray[Any, np.dtype[np.uint8]]:
     result: np.ndarray[Any, np.dtype[np.uint8]] = np.zeros(
-        blocks.shape, dtype=np.uint8)
-    prev_block: np.ndarray[Any, np.dtype[np.uint8]] = np.random.randint(
-        0, 2, blocks[0].shape, dtype=np.uint8)
+        unique_blocks.shape, dtype=np.uint8)
+    mac: Any = keyed_mac(key, backend, blocks[0].size)
+    for block, out in zip(unique_blocks, result.reshape(len(result), -1)):
+        encode_into(mac, block, out)
+
+    return result[inverse.reshape(-1)]
+
+
+def encode_blocks_CBC(blocks: np.ndarray[Any, np.dtype[np.uint8]], key: str = "", iv: np.ndarray[Any, np.dtype[np.uint8]] | None = None, backend: str = "hmac-md5") -> np.ndarray[Any, np.dtype[np.uint8]]:
+    flat_blocks: np.ndarray[Any, np.dtype[np.uint8]] = blocks.reshape(
+        len(blocks), -1)
+    result: np.ndarray[Any, np.dtype[np.uint8]] = np.zeros(
+        flat_blocks.shape, dtype=np.uint8)
+    # A given iv continues the chain of a previous call
+    if iv is None:
+        iv = np.random.randint(0, 2, blocks[0].shape, dtype=np.uint8)
+    prev_block: np.ndarray[Any, np.dtype[np.uint8]] = iv.reshape(-1)
+
+    # Only the XOR with the previous ciphertext block and the digest are
+    # left in the serial loop
+    mac: Any = keyed_mac(key, backend, blocks[0].size)
+    for block, out in zip(flat_blocks, result):
+        encode_into(mac, block ^ prev_block, out)
+        prev_block = out
+    return result.reshape(blocks.shape)
+
+
+# signature, file size, reserved, reserved, pixel data offset
+BMP_HEADER = struct.Struct("<2sIHHI")
+# header size, width, height, planes, bits per pixel, compression, image size,
+# horizontal and vertical resolution, colours used, important colours
+BMP_INFO_HEADER = struct.Struct("<IiiHHIIiiII")
+
+
+def map_bmp(path: str) -> tuple[np.ndarray[Any, np.dtype[np.uint8]], np.ndarray[Any, np.dtype[np.uint8]] | None]:
+    # Memory maps the pixel rows of an uncompressed 8, 24 or 32 bit BMP as a
+    # top-down (height, width, channels) view, nothing is read until sliced.
+    # 8 bit images come with their 256 x 4 BGRX palette
+    with open(path, "rb") as f:
+        header: bytes = f.read(BMP_HEADER.size + BMP_INFO_HEADER.size)
+        signature, _, _, _, offset = BMP_HEADER.unpack_from(header)
+        info_size, width, height, _, bits, compression, *_ = BMP_INFO_HEADER.unpack_from(
+            header, BMP_HEADER.size)
+        palette: np.ndarray[Any, np.dtype[np.uint8]] | None = None
+        if bits == 8:
+            f.seek(BMP_HEADER.size + info_size)
+            colours: np.ndarray[Any, np.dtype[np.uint8]] = np.frombuffer(
+                f.read(offset - BMP_HEADER.size - info_size), dtype=np.uint8)
+            palette = np.zeros((256, 4), dtype=np.uint8)
+            palette[:len(colours) // 4] = colours[:len(colours) // 4 * 4].reshape(-1, 4)
+    if signature != b"BM" or bits not in (8, 24, 32) or compression not in (0, 3):
+        raise ValueError(f"{path} is not an uncompressed 8, 24 or 32 bit BMP")
+
+    channels: int = bits // 8
+    row_bytes: int = (width * channels + 3) // 4 * 4
+    rows: np.ndarray[Any, np.dtype[np.uint8]] = np.memmap(
+        path, dtype=np.uint8, mode="r", offset=offset, shape=(abs(height), row_bytes))
+    pixels: np.ndarray[Any, np.dtype[np.uint8]] = rows[:, :width * channels].reshape(
+        abs(height), width, channels)
+    # Positive height means the rows are stored bottom-up
+    return (pixels[::-1] if height > 0 else pixels), palette
+
+
+def to_rgb(pixels: np.ndarray[Any, np.dtype[np.uint8]], palette: np.ndarray[Any, np.dtype[np.uint8]] | None = None) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # BGR(X) pixels or palette indices to H x W x 3 RGB
+    if palette is not None:
+        return palette[pixels[..., 0], 2::-1]
+    return pixels[..., 2::-1]
 
-    for i, block in enumerate(blocks):
-        new_block: np.ndarray[Any, np.dtype[np.uint8]] = np.array([pixel ^ prev_pixel for pixel, prev_pixel in zip(
-            block.flatten(), prev_block.flatten())])
 
-        new_block = new_block.reshape(
-            blocks[0].shape)
-        new_block = encode_single_block(new_block, key)
+def to_gray(pixels: np.ndarray[Any, np.dtype[np.uint8]], palette: np.ndarray[Any, np.dtype[np.uint8]] | None = None) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Same ITU-R 601-2 luma as Image.convert("L")
+    rgb: np.ndarray[Any, np.dtype[np.uint32]] = to_rgb(pixels, palette).astype(np.uint32)
+    return ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
 
-        prev_block = new_block
-        result[i] = new_block
-    return result
+
+def bmp_header(width: int, height: int, colour: bool = False) -> bytes:
+    # Headers of a bottom-up 8 bit grayscale or 24 bit colour BMP, the
+    # grayscale one ends with its identity palette
+    channels: int = 3 if colour else 1
+    row_bytes: int = (width * channels + 3) // 4 * 4
+    palette: bytes = b"" if colour else np.repeat(np.arange(256, dtype=np.uint8), 4).tobytes()
+    offset: int = BMP_HEADER.size + BMP_INFO_HEADER.size + len(palette)
+    return (BMP_HEADER.pack(b"BM", offset + row_bytes * height, 0, 0, offset)
+            + BMP_INFO_HEADER.pack(BMP_INFO_HEADER.size, width, height, 1, channels * 8, 0,
+                                   row_bytes * height, 2835, 2835, 0 if colour else 256, 0)
+            + palette)
+
+
+def create_bmp(path: str, width: int, height: int, colour: bool = False) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    # Preallocates an 8 bit grayscale or 24 bit colour BMP and returns its
+    # pixels as a writable, top-down memory mapped (height, width) or
+    # (height, width, 3) RGB view
+    row_bytes: int = (width * (3 if colour else 1) + 3) // 4 * 4
+    header: bytes = bmp_header(width, height, colour)
+    offset: int = len(header)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.truncate(offset + row_bytes * height)
+    rows: np.ndarray[Any, np.dtype[np.uint8]] = np.memmap(
+        path, dtype=np.uint8, mode="r+", offset=offset, shape=(height, row_bytes))
+    if colour:
+        return rows[::-1, :width * 3].reshape(height, width, 3)[..., ::-1]
+    return rows[::-1, :width]
+
+
+def save_image(path: str, image: np.ndarray[Any, np.dtype[np.uint8]]) -> None:
+    # H x W arrays are saved as grayscale, H x W x 3 as RGB. BMPs are written
+    # directly as the header and one buffer, other formats go through Pillow
+    if not path.lower().endswith(".bmp"):
+        from PIL import Image
+        Image.fromarray(image).save(path)
+        return
+    colour: bool = image.ndim == 3
+    height: int
+    width: int
+    height, width = image.shape[:2]
+    row_bytes: int = (width * (3 if colour else 1) + 3) // 4 * 4
+    rows: np.ndarray[Any, np.dtype[np.uint8]] = np.zeros(
+        (height, row_bytes), dtype=np.uint8)
+    rows[:, :image[0].size] = (image[::-1, :, ::-1] if colour else image[::-1]).reshape(height, -1)
+    with open(path, "wb") as f:
+        f.write(bmp_header(width, height, colour))
+        f.write(rows.data)
+
+
+def encode_bmp_stream(source: str, destination: str, block_size: int, key: str = "", mode: str = "ECB", colour: bool = False, backend: str = "hmac-md5") -> None:
+    # Encrypts one stripe of block_size pixel rows at a time, so the memory
+    # used is bounded by a stripe instead of the whole image
+    pixels, palette = map_bmp(source)
+    height: int = pixels.shape[0] // block_size * block_size
+    width: int = pixels.shape[1] // block_size * block_size
+    output: np.ndarray[Any, np.dtype[np.uint8]] = create_bmp(destination, width, height, colour)
+
+    iv: np.ndarray[Any, np.dtype[np.uint8]] | None = None
+    if mode == "CBC":
+        iv = np.random.randint(0, 2, (block_size, block_size), dtype=np.uint8)
+    for top in range(0, height, block_size):
+        stripe: np.ndarray[Any, np.dtype[np.uint8]] = (to_rgb if colour else to_gray)(
+            pixels[top:top + block_size, :width], palette)
+        blocks: np.ndarray[Any, np.dtype[np.uint8]] = split_into_blocks(stripe, block_size)
+        if mode == "CBC":
+            blocks = encode_blocks_CBC(blocks, key, iv, backend)
+            iv = blocks[-1]
+        else:
+            blocks = encode_blocks_ECB(blocks, key, backend)
+        output[top:top + block_size] = join_blocks(blocks, stripe.shape)
+    output.base.flush()
+
+
+def benchmark_backends(block_sizes: tuple[int, ...] = (4, 8, 16), count: int = 20000) -> None:
+    # CBC over random blocks, so every block costs one PRF call
+    rng: np.random.Generator = np.random.default_rng(0)
+    for block_size in block_sizes:
+        blocks: np.ndarray[Any, np.dtype[np.uint8]] = rng.integers(
+            0, 256, (count, block_size, block_size), dtype=np.uint8)
+        for backend in PRF_BACKENDS:
+            encode_blocks_CBC(blocks[:100], "benchmark", backend=backend)
+            start: float = time.perf_counter()
+            encode_blocks_CBC(blocks, "benchmark", backend=backend)
+            seconds: float = time.perf_counter() - start
+            print(f"{backend:<12} {block_size:>2}x{block_size:<2} {count / seconds:>12.0f} blocks/s")
 
 
 def resizeImage(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int) -> np.ndarray[Any, np.dtype[np.uint8]]:
@@ -74,13 +256,13 @@ def resizeImage(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int) ->
                  :image.shape[1] // block_size * block_size]
 
 
-def encodeECBandSave(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int, key: str, debug: bool, blocks: np.ndarray[Any, np.dtype[np.uint8]]) -> None:
+def encodeECBandSave(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int, key: str, debug: bool, blocks: np.ndarray[Any, np.dtype[np.uint8]], backend: str = "hmac-md5") -> None:
     image_encoded: np.ndarray[Any, np.dtype[np.uint8]
-                              ] = encode_blocks_ECB(blocks, key)
+                              ] = encode_blocks_ECB(blocks, key, backend)
     image_reconstructed: np.ndarray[Any, np.dtype[np.uint8]] = join_blocks(
         image_encoded, image.shape)
 
-    plt.imsave(f"ecb_crypto.bmp", image_reconstructed, cmap="gray")
+    save_image("ecb_crypto.bmp", image_reconstructed)
     if debug:
         print("ECB ENCODING:")
         print(f"Block size: {block_size}")
@@ -91,13 +273,12 @@ def encodeECBandSave(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int
         print(f"Images saved as ecb_crypto.bmp")
 
 
-def encodeCBCandSave(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int, key: str, debug: bool, blocks: np.ndarray[Any, np.dtype[np.uint8]]) -> None:
+def encodeCBCandSave(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int, key: str, debug: bool, blocks: np.ndarray[Any, np.dtype[np.uint8]], backend: str = "hmac-md5") -> None:
     image_encoded: np.ndarray[Any, np.dtype[np.uint8]
-                              ] = encode_blocks_CBC(blocks, key)
+                              ] = encode_blocks_CBC(blocks, key, backend=backend)
     image_reconstructed: np.ndarray[Any, np.dtype[np.uint8]] = join_blocks(
         image_encoded, tuple(image.shape))
-    plt.imsave(f"cbc_crypto.bmp",
-               image_reconstructed, cmap="gray")
+    save_image("cbc_crypto.bmp", image_reconstructed)
     if debug:
         print("CBC ENCODING:")
         print(f"Block size: {block_size}")
@@ -108,19 +289,29 @@ def encodeCBCandSave(image: np.ndarray[Any, np.dtype[np.uint8]], block_size: int
         print(f"Images saved as cbc_crypto.bmp")
 
 
-def main() -> None:
-    debug: bool = False
-    block_size: int = 4
-    image_name: str = "plain"
+def main(block_size: int = 4, image_name: str = "plain", backend: str = "hmac-md5",
+         stream: bool = False, colour: bool = False, debug: bool = False) -> None:
+    # stream: encrypt the BMP stripe by stripe for images that do not fit in memory
+    # colour: encrypt the RGB channels instead of a grayscale conversion
     key: str = ""
     try:
         with open("key.txt", "r") as file:
             key = file.read().strip()
     except FileNotFoundError:
         pass
+    if stream:
+        try:
+            encode_bmp_stream(f"{image_name}.bmp", "ecb_crypto.bmp", block_size, key, "ECB", colour, backend)
+            encode_bmp_stream(f"{image_name}.bmp", "cbc_crypto.bmp", block_size, key, "CBC", colour, backend)
+        except FileNotFoundError:
+            print(f"File {image_name}.bmp not found")
+            return
+        if debug:
+            print(f"Images saved as ecb_crypto.bmp and cbc_crypto.bmp")
+        return
     try:
         image: np.ndarray[Any, np.dtype[np.uint8]
-                          ] = load_image(f'{image_name}.bmp')
+                          ] = load_image(f'{image_name}.bmp', colour)
     except FileNotFoundError:
         print(f"File {image_name}.bmp not found")
         return
@@ -133,9 +324,34 @@ def main() -> None:
                        ] = split_into_blocks(image, block_size)
 
     # Encoding and saving images
-    encodeECBandSave(image, block_size, key, debug, blocks)
-    encodeCBCandSave(image, block_size, key, debug, blocks)
+    encodeECBandSave(image, block_size, key, debug, blocks, backend)
+    encodeCBCandSave(image, block_size, key, debug, blocks, backend)
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(
+        description="Encrypt an image with a keyed PRF in ECB and CBC modes.")
+    parser.add_argument("-i", "--image", default="plain",
+                        help="Name of the BMP image without the extension")
+    parser.add_argument("-n", "--block-size", type=int, default=4,
+                        help="Side of the square blocks in pixels")
+    parser.add_argument("--backend", choices=PRF_BACKENDS, default="hmac-md5",
+                        help="Keyed PRF used as the block transform")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="Encrypt the BMP one stripe at a time")
+    parser.add_argument("-c", "--colour", action="store_true",
+                        help="Keep the RGB channels instead of converting to grayscale")
+    parser.add_argument("--debug", action="store_true",
+                        help="Print the shapes of the intermediate arrays")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Print blocks/s of every backend for 4x4, 8x8 and 16x16 blocks")
+
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark_backends()
+        return
+    main(args.block_size, args.image, args.backend, args.stream, args.colour, args.debug)
 
 
 if __name__ == "__main__":
-    main()
+    cli()